@@ -2,29 +2,54 @@ import numpy as np
 from typing import Dict, List, Any
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
+from concurrent.futures import ThreadPoolExecutor
 import torch
 import torch.nn as nn
 import pandas as pd
+import treelite
+import tl2cgen
+import threading
+import tempfile
+import warnings
+import os
+
+# Native compilation of trained forests runs here, off the training path
+_compile_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="nexus-risk-compile"
+)
 
 
 class HealthPredictor(nn.Module):
     def __init__(self, input_size: int, hidden_size: int, num_classes: int):
         super(HealthPredictor, self).__init__()
+        self.quant = torch.ao.quantization.QuantStub()
         self.layer1 = nn.Linear(input_size, hidden_size)
-        self.relu = nn.ReLU()
+        self.relu1 = nn.ReLU()
         self.layer2 = nn.Linear(hidden_size, hidden_size)
+        self.relu2 = nn.ReLU()
         self.layer3 = nn.Linear(hidden_size, num_classes)
+        self.dequant = torch.ao.quantization.DeQuantStub()
         self.softmax = nn.Softmax(dim=1)
 
     def forward(self, x):
+        x = self.quant(x)
         x = self.layer1(x)
-        x = self.relu(x)
+        x = self.relu1(x)
         x = self.layer2(x)
-        x = self.relu(x)
+        x = self.relu2(x)
         x = self.layer3(x)
-        x = self.softmax(x)
+        x = self.dequant(x)
+        # Softmax is monotonic, so inference returns raw scores
+        if self.training:
+            x = self.softmax(x)
         return x
 
+    def fuse(self):
+        """Fuse the Linear+ReLU pairs into single modules"""
+        torch.ao.quantization.fuse_modules(
+            self, [["layer1", "relu1"], ["layer2", "relu2"]], inplace=True
+        )
+
 
 class HealthAnalyzer:
     def __init__(self):
@@ -32,33 +57,133 @@ class HealthAnalyzer:
         self.risk_classifier = RandomForestClassifier(n_estimators=100)
         self.neural_predictor = None
         self.initialized = False
+        self._fast_predictor = None
+        self._fast_predictor_path = None
+        self._model_dir = None
+        self._model_generation = 0
+        self._model_lock = threading.Lock()
+        self._compile_future = None
+        self._traced_predictor = None
 
     def initialize_neural_network(
         self, input_size: int, hidden_size: int = 64, num_classes: int = 5
     ):
         """Initialize the neural network model"""
         self.neural_predictor = HealthPredictor(input_size, hidden_size, num_classes)
+        self._traced_predictor = None
+
+    def quantize(self, calibration_data: List[Dict[str, Any]]):
+        """Convert the neural network to INT8 using static quantization"""
+        if not self.neural_predictor:
+            raise ValueError("Neural network not initialized")
+
+        model = self.neural_predictor
+        model.eval()
+        model.fuse()
+        model.qconfig = torch.ao.quantization.get_default_qconfig("x86")
+        torch.ao.quantization.prepare(model, inplace=True)
+
+        # Calibrate activation ranges on representative inputs
+        with torch.no_grad():
+            model(torch.FloatTensor(self.preprocess_data(calibration_data)))
+
+        torch.ao.quantization.convert(model, inplace=True)
+        self._traced_predictor = None
 
     def preprocess_data(self, data: List[Dict[str, Any]]) -> np.ndarray:
         """Preprocess medical data for analysis"""
         df = pd.DataFrame(data)
-        numerical_features = df.select_dtypes(include=[np.number]).columns
 
         if not self.initialized:
-            self.scaler.fit(df[numerical_features])
+            # Freeze the feature order and scaler parameters on first fit
+            self._num_features = list(df.select_dtypes(include=[np.number]).columns)
+            self.scaler.fit(df[self._num_features])
+            self._mean = self.scaler.mean_
+            self._scale = self.scaler.scale_
             self.initialized = True
 
-        return self.scaler.transform(df[numerical_features])
+        # Same arithmetic as StandardScaler.transform without its validation
+        values = df[self._num_features].to_numpy(dtype=np.float64)
+        return (values - self._mean) / self._scale
 
-    def train_risk_model(self, training_data: List[Dict[str, Any]], labels: List[int]):
+    def train_risk_model(
+        self,
+        training_data: List[Dict[str, Any]],
+        labels: List[int],
+        compile_in_background: bool = True,
+    ):
         """Train the risk assessment model"""
         X = self.preprocess_data(training_data)
         self.risk_classifier.fit(X, labels)
 
+        # The previous native predictor no longer matches the forest; fall
+        # back to predict_proba until the new one is compiled
+        with self._model_lock:
+            self._fast_predictor = None
+            self._model_generation += 1
+            if self._fast_predictor_path is not None:
+                os.remove(self._fast_predictor_path)
+                self._fast_predictor_path = None
+
+        try:
+            model = treelite.sklearn.import_model(self.risk_classifier)
+        except Exception as exc:
+            warnings.warn(f"Risk model compilation failed: {exc}")
+            return
+
+        if self._model_dir is None:
+            self._model_dir = tempfile.TemporaryDirectory(prefix="nexus-risk-")
+        if compile_in_background:
+            self._compile_future = _compile_executor.submit(
+                self._compile_risk_model, model, self._model_generation
+            )
+        else:
+            self._compile_risk_model(model, self._model_generation)
+
+    def _compile_risk_model(self, model, generation: int):
+        """Compile the trained forest into a native predictor library"""
+        libpath = os.path.join(self._model_dir.name, f"risk_model_{generation}.so")
+        try:
+            tl2cgen.export_lib(
+                model,
+                toolchain="gcc",
+                libpath=libpath,
+                params={"parallel_comp": os.cpu_count() or 1},
+            )
+            predictor = tl2cgen.Predictor(libpath)
+        except Exception as exc:
+            warnings.warn(f"Risk model compilation failed: {exc}")
+            if os.path.exists(libpath):
+                os.remove(libpath)
+            return
+
+        with self._model_lock:
+            if generation != self._model_generation:
+                # The forest was retrained while this one compiled
+                os.remove(libpath)
+                return
+            self._fast_predictor = predictor
+            self._fast_predictor_path = libpath
+
     def predict_health_risks(self, patient_data: Dict[str, Any]) -> Dict[str, float]:
         """Predict health risks for a patient"""
-        processed_data = self.preprocess_data([patient_data])
-        risk_probabilities = self.risk_classifier.predict_proba(processed_data)[0]
+        fast_predictor = self._fast_predictor
+        if fast_predictor is not None:
+            x = np.fromiter(
+                (patient_data[feature] for feature in self._num_features),
+                dtype=np.float64,
+                count=len(self._num_features),
+            )
+            # Standardize in float64 and then narrow, as sklearn's trees do;
+            # scaling in float32 can land on the other side of a split
+            x = ((x - self._mean) / self._scale).astype(np.float32)
+            # Output shape is (rows, targets, classes)
+            risk_probabilities = fast_predictor.predict(
+                tl2cgen.DMatrix(x.reshape(1, -1))
+            )[0, 0]
+        else:
+            processed_data = self.preprocess_data([patient_data])
+            risk_probabilities = self.risk_classifier.predict_proba(processed_data)[0]
 
         return {
             "low_risk": float(risk_probabilities[0]),
@@ -66,29 +191,42 @@ class HealthAnalyzer:
             "high_risk": float(risk_probabilities[2]),
         }
 
-    def analyze_trends(self, historical_data: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Analyze health trends from historical data"""
-        df = pd.DataFrame(historical_data)
+    def analyze_trends(self, values: np.ndarray, columns: List[str]) -> Dict[str, Any]:
+        """Analyze health trends from a records x metrics array of history"""
+        arr = np.asarray(values, dtype=np.float64)
 
         analysis = {"trends": {}, "anomalies": [], "recommendations": []}
 
-        # Analyze trends for numerical values
-        for column in df.select_dtypes(include=[np.number]).columns:
-            trend = {
-                "mean": float(df[column].mean()),
-                "std": float(df[column].std()),
-                "min": float(df[column].min()),
-                "max": float(df[column].max()),
+        # Analyze trends for all metrics at once. NaN marks a missing value;
+        # ddof=1 matches the pandas Series reductions, so single-sample
+        # columns get a NaN std.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            means = np.nanmean(arr, axis=0)
+            stds = np.nanstd(arr, axis=0, ddof=1)
+            mins = np.nanmin(arr, axis=0)
+            maxs = np.nanmax(arr, axis=0)
+
+        analysis["trends"] = {
+            column: {
+                "mean": float(mean),
+                "std": float(std),
+                "min": float(low),
+                "max": float(high),
             }
-            analysis["trends"][column] = trend
+            for column, mean, std, low, high in zip(columns, means, stds, mins, maxs)
+        }
 
-            # Detect anomalies (values outside 2 standard deviations)
-            mean = trend["mean"]
-            std = trend["std"]
-            anomalies = df[abs(df[column] - mean) > 2 * std]
-            if not anomalies.empty:
+        # Detect anomalies (values outside 2 standard deviations)
+        # Scanning the transposed mask yields hits grouped by column with
+        # rows ascending, so each metric is a contiguous slice
+        cols, rows = np.nonzero((np.abs(arr - means) > 2 * stds).T)
+        bounds = np.searchsorted(cols, np.arange(len(columns) + 1))
+        for j, column in enumerate(columns):
+            metric_rows = rows[bounds[j] : bounds[j + 1]]
+            if metric_rows.size:
                 analysis["anomalies"].append(
-                    {"metric": column, "dates": anomalies.index.tolist()}
+                    {"metric": column, "dates": metric_rows.tolist()}
                 )
 
         return analysis
@@ -117,15 +255,20 @@ class HealthAnalyzer:
         historical_data: List[Dict[str, Any]],
         target_metric: str,
         prediction_window: int = 30,
+        probabilities: bool = False,
     ) -> List[float]:
         """Predict future health metrics using neural network"""
         if not self.neural_predictor:
             raise ValueError("Neural network not initialized")
 
-        df = pd.DataFrame(historical_data)
         X = torch.FloatTensor(self.preprocess_data(historical_data))
 
         with torch.no_grad():
-            predictions = self.neural_predictor(X)
+            if self._traced_predictor is None:
+                self.neural_predictor.eval()
+                self._traced_predictor = torch.jit.trace(self.neural_predictor, X)
+            predictions = self._traced_predictor(X)
+            if probabilities:
+                predictions = torch.softmax(predictions, dim=1)
 
         return predictions.numpy().tolist()
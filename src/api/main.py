@@ -1,11 +1,19 @@
 from fastapi import FastAPI, HTTPException, Depends, Security
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
 from passlib.context import CryptContext
+from cachetools import TTLCache
+import functools
+import threading
+import time
+import jwt
+import hashlib
+import hmac
+import os
 import uvicorn
 
 from src.blockchain.blockchain import MedicalBlockchain
@@ -16,13 +24,21 @@ from src.data_management.medical_data import MedicalDataManager
 SECRET_KEY = "your-secret-key-here"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+_HMAC_KEY = SECRET_KEY.encode()
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Successful bcrypt verifications, keyed by a process-local HMAC of the
+# plaintext so the password itself is never held in the cache
+_verified_passwords = TTLCache(maxsize=4096, ttl=60)
+_verified_passwords_lock = threading.Lock()
+_VERIFY_CACHE_KEY = os.urandom(32)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 app = FastAPI(
     title="Decentralized Medical Data Management",
     description="AI-driven decentralized platform for medical data management",
+    default_response_class=ORJSONResponse,
 )
 
 # CORS configuration
@@ -68,7 +84,20 @@ class MedicalData(BaseModel):
 
 # Security functions
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    cache_key = (
+        hmac.new(_VERIFY_CACHE_KEY, plain_password.encode(), hashlib.sha256).digest(),
+        hashed_password,
+    )
+    with _verified_passwords_lock:
+        if cache_key in _verified_passwords:
+            return True
+
+    # Only successes are cached so failed attempts always pay the bcrypt cost
+    if not pwd_context.verify(plain_password, hashed_password):
+        return False
+    with _verified_passwords_lock:
+        _verified_passwords[cache_key] = True
+    return True
 
 
 def get_password_hash(password):
@@ -79,10 +108,21 @@ def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, _HMAC_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+@functools.lru_cache(maxsize=16384)
+def _decode_token(token: str) -> Dict[str, Any]:
+    # Invalid tokens raise and are therefore never cached
+    return jwt.decode(
+        token,
+        _HMAC_KEY,
+        algorithms=[ALGORITHM],
+        options={"require": ["exp", "sub"]},
+    )
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=401,
@@ -90,12 +130,15 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(token)
+        # A cached payload may have expired since it was first verified
+        if payload["exp"] <= time.time():
+            raise credentials_exception
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
-    except JWTError:
+    except jwt.PyJWTError:
         raise credentials_exception
     return token_data
 
@@ -162,13 +205,13 @@ async def get_health_analysis(
 ):
     """Get AI-powered health analysis"""
     try:
-        patient_history = data_manager.get_patient_history(
+        values, columns = data_manager.get_patient_history_array(
             patient_id, current_user.username
         )
-        if not patient_history:
+        if values.shape[0] == 0:
             raise HTTPException(status_code=404, detail="No records found")
 
-        analysis = health_analyzer.analyze_trends(patient_history)
+        analysis = health_analyzer.analyze_trends(values, columns)
         recommendations = health_analyzer.generate_health_recommendations(analysis)
 
         return {"analysis": analysis, "recommendations": recommendations}
@@ -0,0 +1,151 @@
+import numpy as np
+from numba import njit, prange
+
+# SHA-256 round constants and initial hash values (FIPS 180-4). Words are
+# held in int64 and masked to 32 bits so numba never mixes signed/unsigned.
+# fmt: off
+_K = np.array(
+    [
+        0x428A2F98, 0x71374491, 0xB5C0FBCF, 0xE9B5DBA5,
+        0x3956C25B, 0x59F111F1, 0x923F82A4, 0xAB1C5ED5,
+        0xD807AA98, 0x12835B01, 0x243185BE, 0x550C7DC3,
+        0x72BE5D74, 0x80DEB1FE, 0x9BDC06A7, 0xC19BF174,
+        0xE49B69C1, 0xEFBE4786, 0x0FC19DC6, 0x240CA1CC,
+        0x2DE92C6F, 0x4A7484AA, 0x5CB0A9DC, 0x76F988DA,
+        0x983E5152, 0xA831C66D, 0xB00327C8, 0xBF597FC7,
+        0xC6E00BF3, 0xD5A79147, 0x06CA6351, 0x14292967,
+        0x27B70A85, 0x2E1B2138, 0x4D2C6DFC, 0x53380D13,
+        0x650A7354, 0x766A0ABB, 0x81C2C92E, 0x92722C85,
+        0xA2BFE8A1, 0xA81A664B, 0xC24B8B70, 0xC76C51A3,
+        0xD192E819, 0xD6990624, 0xF40E3585, 0x106AA070,
+        0x19A4C116, 0x1E376C08, 0x2748774C, 0x34B0BCB5,
+        0x391C0CB3, 0x4ED8AA4A, 0x5B9CCA4F, 0x682E6FF3,
+        0x748F82EE, 0x78A5636F, 0x84C87814, 0x8CC70208,
+        0x90BEFFFA, 0xA4506CEB, 0xBEF9A3F7, 0xC67178F2,
+    ],
+    dtype=np.int64,
+)
+_H0 = np.array(
+    [
+        0x6A09E667, 0xBB67AE85, 0x3C6EF372, 0xA54FF53A,
+        0x510E527F, 0x9B05688C, 0x1F83D9AB, 0x5BE0CD19,
+    ],
+    dtype=np.int64,
+)
+# fmt: on
+_MASK = 0xFFFFFFFF
+
+# Nonces are searched in rounds of _CHUNKS * _CHUNK_SIZE, one chunk per
+# prange iteration.
+_CHUNKS = 64
+_CHUNK_SIZE = 4096
+_MAX_NONCE = 1 << 40
+
+
+@njit(inline="always")
+def _rotr(x, n):
+    return ((x >> n) | (x << (32 - n))) & _MASK
+
+
+@njit(nogil=True, cache=True)
+def _compress(state, block, offset, w):
+    """Run the SHA-256 compression function over block[offset:offset + 64]"""
+    for t in range(16):
+        i = offset + 4 * t
+        w[t] = (
+            (np.int64(block[i]) << 24)
+            | (np.int64(block[i + 1]) << 16)
+            | (np.int64(block[i + 2]) << 8)
+            | np.int64(block[i + 3])
+        )
+    for t in range(16, 64):
+        s0 = _rotr(w[t - 15], 7) ^ _rotr(w[t - 15], 18) ^ (w[t - 15] >> 3)
+        s1 = _rotr(w[t - 2], 17) ^ _rotr(w[t - 2], 19) ^ (w[t - 2] >> 10)
+        w[t] = (w[t - 16] + s0 + w[t - 7] + s1) & _MASK
+
+    a = state[0]
+    b = state[1]
+    c = state[2]
+    d = state[3]
+    e = state[4]
+    f = state[5]
+    g = state[6]
+    h = state[7]
+    for t in range(64):
+        s1 = _rotr(e, 6) ^ _rotr(e, 11) ^ _rotr(e, 25)
+        ch = (e & f) ^ (~e & g & _MASK)
+        temp1 = (h + s1 + ch + _K[t] + w[t]) & _MASK
+        s0 = _rotr(a, 2) ^ _rotr(a, 13) ^ _rotr(a, 22)
+        maj = (a & b) ^ (a & c) ^ (b & c)
+        temp2 = (s0 + maj) & _MASK
+        h = g
+        g = f
+        f = e
+        e = (d + temp1) & _MASK
+        d = c
+        c = b
+        b = a
+        a = (temp1 + temp2) & _MASK
+
+    state[0] = (state[0] + a) & _MASK
+    state[1] = (state[1] + b) & _MASK
+    state[2] = (state[2] + c) & _MASK
+    state[3] = (state[3] + d) & _MASK
+    state[4] = (state[4] + e) & _MASK
+    state[5] = (state[5] + f) & _MASK
+    state[6] = (state[6] + g) & _MASK
+    state[7] = (state[7] + h) & _MASK
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def find_nonce(prefix, target_leading_zero_bytes):
+    """Return the smallest nonce whose SHA-256 over prefix || nonce
+    (8 bytes, little-endian) starts with the given number of zero bytes,
+    or -1 if none exists below 2**40
+    """
+    w = np.empty(64, dtype=np.int64)
+
+    # Midstate over every complete 64-byte block of the prefix
+    midstate = _H0.copy()
+    full_blocks = prefix.size // 64
+    for i in range(full_blocks):
+        _compress(midstate, prefix, i * 64, w)
+
+    # Padded tail template: remaining prefix bytes, nonce slot, 0x80,
+    # zero fill, then the message length in bits (big-endian)
+    tail_len = prefix.size - full_blocks * 64
+    tail_blocks = 1 if tail_len + 8 + 9 <= 64 else 2
+    tail = np.zeros(tail_blocks * 64, dtype=np.uint8)
+    tail[:tail_len] = prefix[full_blocks * 64 :]
+    tail[tail_len + 8] = 0x80
+    bit_len = (prefix.size + 8) * 8
+    for i in range(8):
+        tail[tail.size - 1 - i] = (bit_len >> (8 * i)) & 0xFF
+
+    shift = 32 - 8 * target_leading_zero_bytes
+    start = 0
+    while start < _MAX_NONCE:
+        found = np.full(_CHUNKS, -1, dtype=np.int64)
+        for chunk in prange(_CHUNKS):
+            block = tail.copy()
+            state = np.empty(8, dtype=np.int64)
+            schedule = np.empty(64, dtype=np.int64)
+            lo = start + chunk * _CHUNK_SIZE
+            for nonce in range(lo, lo + _CHUNK_SIZE):
+                for i in range(8):
+                    block[tail_len + i] = (nonce >> (8 * i)) & 0xFF
+                state[:] = midstate
+                _compress(state, block, 0, schedule)
+                if tail_blocks == 2:
+                    _compress(state, block, 64, schedule)
+                if (state[0] >> shift) == 0:
+                    found[chunk] = nonce
+                    break
+
+        # Chunks cover ascending nonce ranges, so the first hit is the
+        # same nonce a sequential search would have found.
+        for chunk in range(_CHUNKS):
+            if found[chunk] >= 0:
+                return found[chunk]
+        start += _CHUNKS * _CHUNK_SIZE
+    return -1
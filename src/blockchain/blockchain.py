@@ -1,8 +1,14 @@
 from typing import List, Dict, Any
+from collections import defaultdict
 from web3 import Web3
 from datetime import datetime
-import json
+import numpy as np
+import orjson
 import hashlib
+import struct
+import time
+
+from src.blockchain._pow_kernel import find_nonce
 
 
 class MedicalBlockchain:
@@ -10,6 +16,10 @@ class MedicalBlockchain:
         self.web3 = Web3(Web3.HTTPProvider(provider_url))
         self.chain: List[Dict[str, Any]] = []
         self.pending_transactions = []
+        # (epoch millisecond, formatted timestamp) for add_transaction
+        self._timestamp_cache = (-1, "")
+        # Committed transactions keyed by recipient, filled in by mine_block
+        self._by_recipient: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
         self._create_genesis_block()
 
     def _create_genesis_block(self):
@@ -19,15 +29,43 @@ class MedicalBlockchain:
             "timestamp": str(datetime.now()),
             "transactions": [],
             "previous_hash": "0" * 64,
+            "previous_hash_bytes": bytes(32),
             "nonce": 0,
         }
-        genesis_block["hash"] = self._calculate_hash(genesis_block)
+        genesis_block["hash_bytes"] = self._calculate_digest(genesis_block)
+        genesis_block["hash"] = genesis_block["hash_bytes"].hex()
         self.chain.append(genesis_block)
 
+    def _block_prefix(self, block: Dict[str, Any]) -> bytes:
+        """Serialize every hashed block field except the nonce"""
+        timestamp = block["timestamp"].encode()
+        return (
+            struct.pack("<QH", block["index"], len(timestamp))
+            + timestamp
+            + block["previous_hash_bytes"]
+            + orjson.dumps(block["transactions"], option=orjson.OPT_SORT_KEYS)
+        )
+
+    def _calculate_digest(self, block: Dict[str, Any]) -> bytes:
+        """Calculate the raw SHA-256 digest of a block"""
+        digest = hashlib.sha256(self._block_prefix(block))
+        digest.update(block["nonce"].to_bytes(8, "little"))
+        return digest.digest()
+
     def _calculate_hash(self, block: Dict[str, Any]) -> str:
         """Calculate hash of a block"""
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+        return self._calculate_digest(block).hex()
+
+    def _transaction_timestamp(self) -> str:
+        """Return the wall-clock time, formatted at most once per millisecond"""
+        now_ms = time.time_ns() // 1_000_000
+        cached_ms, timestamp = self._timestamp_cache
+        if now_ms != cached_ms:
+            timestamp = datetime.fromtimestamp(now_ms / 1000).isoformat(
+                sep=" ", timespec="microseconds"
+            )
+            self._timestamp_cache = (now_ms, timestamp)
+        return timestamp
 
     def add_transaction(self, sender: str, recipient: str, data: Dict[str, Any]):
         """Add a new transaction to pending transactions"""
@@ -35,7 +73,7 @@ class MedicalBlockchain:
             "sender": sender,
             "recipient": recipient,
             "data": data,
-            "timestamp": str(datetime.now()),
+            "timestamp": self._transaction_timestamp(),
         }
         self.pending_transactions.append(transaction)
         return self.get_last_block()["index"] + 1
@@ -48,48 +86,53 @@ class MedicalBlockchain:
             "timestamp": str(datetime.now()),
             "transactions": self.pending_transactions,
             "previous_hash": previous_block["hash"],
+            "previous_hash_bytes": previous_block["hash_bytes"],
             "nonce": 0,
         }
 
-        # Proof of Work
-        while not self._is_hash_valid(self._calculate_hash(new_block)):
-            new_block["nonce"] += 1
-
-        new_block["hash"] = self._calculate_hash(new_block)
+        # Proof of Work: search nonces in the compiled kernel. Two leading
+        # zero bytes equal a "0000" hex prefix.
+        prefix = np.frombuffer(self._block_prefix(new_block), dtype=np.uint8)
+        new_block["nonce"] = int(find_nonce(prefix, 2))
+        new_block["hash_bytes"] = self._calculate_digest(new_block)
+        new_block["hash"] = new_block["hash_bytes"].hex()
         self.chain.append(new_block)
+        for transaction in new_block["transactions"]:
+            self._by_recipient[transaction["recipient"]].append(transaction)
         self.pending_transactions = []
         return new_block
 
-    def _is_hash_valid(self, hash_string: str) -> bool:
-        """Check if hash meets difficulty requirements"""
-        return hash_string.startswith("0000")
+    def _is_hash_valid(self, digest: bytes) -> bool:
+        """Check if a raw digest meets difficulty requirements"""
+        return digest[0] == 0 and digest[1] == 0
 
     def get_last_block(self) -> Dict[str, Any]:
         """Return the last block in the chain"""
         return self.chain[-1]
 
-    def is_chain_valid(self) -> bool:
+    def is_chain_valid(self, rehash: bool = True) -> bool:
         """Validate the entire blockchain"""
         for i in range(1, len(self.chain)):
             current_block = self.chain[i]
             previous_block = self.chain[i - 1]
 
-            if current_block["previous_hash"] != previous_block["hash"]:
+            if current_block["previous_hash_bytes"] != previous_block["hash_bytes"]:
                 return False
 
-            if not self._is_hash_valid(current_block["hash"]):
+            if not self._is_hash_valid(current_block["hash_bytes"]):
                 return False
 
-            if self._calculate_hash(current_block) != current_block["hash"]:
+            # rehash=False trusts the stored digest of locally mined blocks
+            if rehash and (
+                self._calculate_digest(current_block) != current_block["hash_bytes"]
+                or current_block["hash"] != current_block["hash_bytes"].hex()
+                or current_block["previous_hash"]
+                != current_block["previous_hash_bytes"].hex()
+            ):
                 return False
 
         return True
 
     def get_patient_data(self, patient_address: str) -> List[Dict[str, Any]]:
         """Retrieve all medical records for a specific patient"""
-        patient_records = []
-        for block in self.chain:
-            for transaction in block["transactions"]:
-                if transaction["recipient"] == patient_address:
-                    patient_records.append(transaction)
-        return patient_records
+        return list(self._by_recipient.get(patient_address, []))
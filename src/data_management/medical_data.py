@@ -1,52 +1,99 @@
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set, Tuple
 from datetime import datetime
-from cryptography.fernet import Fernet
-import json
-import base64
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+import numpy as np
+import itertools
+import orjson
+import os
 
 
-class MedicalRecord:
-    def __init__(self, patient_id: str, data: Dict[str, Any], encryption_key: bytes):
-        self.patient_id = patient_id
-        self.timestamp = datetime.now()
-        self.encryption_handler = Fernet(encryption_key)
-        self.encrypted_data = self._encrypt_data(data)
-        self.access_log = []
+class MedicalDataManager:
+    def __init__(self):
+        # One column store per patient; index i across every list is record i
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.encryption_key = os.urandom(32)
+        self._aead = AESGCM(self.encryption_key)
+        self.access_policies: Dict[str, Set[str]] = {}
+
+    @staticmethod
+    def _new_table() -> Dict[str, Any]:
+        """Create an empty record table for a patient"""
+        return {
+            "encrypted": [],
+            "nonces": [],
+            "timestamps": [],
+            "access_logs": [],
+            "metrics": {},
+        }
 
-    def _encrypt_data(self, data: Dict[str, Any]) -> bytes:
-        """Encrypt medical data"""
-        json_data = json.dumps(data)
-        return self.encryption_handler.encrypt(json_data.encode())
+    @staticmethod
+    def _store_metrics(table: Dict[str, Any], record_index: int, data: Dict[str, Any]):
+        """Write a record's numeric fields into the patient's metric columns"""
+        metrics = table["metrics"]
+        rows = len(table["encrypted"])
+        for column in metrics.values():
+            if len(column) < rows:
+                column.append(np.nan)
+            else:
+                column[record_index] = np.nan
+
+        for key, value in data.items():
+            if key not in metrics:
+                metrics[key] = [np.nan] * rows
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metrics[key][record_index] = float(value)
+            elif value is not None:
+                # None marks the column as non-numeric
+                metrics[key][record_index] = None
+
+    def _encrypt_data(self, data: Dict[str, Any]) -> Tuple[bytes, bytes]:
+        """Encrypt medical data, returning (nonce, ciphertext)"""
+        nonce = os.urandom(12)
+        payload = orjson.dumps(
+            data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        )
+        return nonce, self._aead.encrypt(nonce, payload, None)
 
-    def decrypt_data(self) -> Dict[str, Any]:
+    def _decrypt_data(self, nonce: bytes, encrypted_data: bytes) -> Dict[str, Any]:
         """Decrypt medical data"""
-        decrypted_data = self.encryption_handler.decrypt(self.encrypted_data)
-        return json.loads(decrypted_data.decode())
+        return orjson.loads(self._aead.decrypt(nonce, encrypted_data, None))
 
-    def log_access(self, accessor_id: str, purpose: str):
+    @staticmethod
+    def _log_access(
+        table: Dict[str, Any], record_index: int, accessor_id: str, purpose: str
+    ):
         """Log access to medical record"""
         access_entry = {
             "accessor_id": accessor_id,
             "timestamp": datetime.now(),
             "purpose": purpose,
         }
-        self.access_log.append(access_entry)
-
+        table["access_logs"][record_index].append(access_entry)
 
-class MedicalDataManager:
-    def __init__(self):
-        self.records: Dict[str, List[MedicalRecord]] = {}
-        self.encryption_key = Fernet.generate_key()
-        self.access_policies: Dict[str, List[str]] = {}
+    @staticmethod
+    def _log_history_access(table: Dict[str, Any], accessor_id: str):
+        """Log a full history review against every record in one pass"""
+        access_entry = {
+            "accessor_id": accessor_id,
+            "timestamp": datetime.now(),
+            "purpose": "History review",
+        }
+        for access_log in table["access_logs"]:
+            access_log.append(access_entry)
 
     def add_record(self, patient_id: str, data: Dict[str, Any]) -> str:
         """Add a new medical record"""
         if patient_id not in self.records:
-            self.records[patient_id] = []
+            self.records[patient_id] = self._new_table()
 
-        record = MedicalRecord(patient_id, data, self.encryption_key)
-        self.records[patient_id].append(record)
-        return str(len(self.records[patient_id]) - 1)
+        table = self.records[patient_id]
+        nonce, encrypted_data = self._encrypt_data(data)
+        table["encrypted"].append(encrypted_data)
+        table["nonces"].append(nonce)
+        table["timestamps"].append(datetime.now())
+        table["access_logs"].append([])
+        self._store_metrics(table, len(table["encrypted"]) - 1, data)
+        return str(len(table["encrypted"]) - 1)
 
     def get_record(
         self, patient_id: str, record_index: int, accessor_id: str, purpose: str
@@ -56,11 +103,13 @@ class MedicalDataManager:
             raise PermissionError("Access denied")
 
         if patient_id in self.records and 0 <= record_index < len(
-            self.records[patient_id]
+            self.records[patient_id]["encrypted"]
         ):
-            record = self.records[patient_id][record_index]
-            record.log_access(accessor_id, purpose)
-            return record.decrypt_data()
+            table = self.records[patient_id]
+            self._log_access(table, record_index, accessor_id, purpose)
+            return self._decrypt_data(
+                table["nonces"][record_index], table["encrypted"][record_index]
+            )
         return None
 
     def get_patient_history(
@@ -73,32 +122,53 @@ class MedicalDataManager:
         if patient_id not in self.records:
             return []
 
-        history = []
-        for record in self.records[patient_id]:
-            record.log_access(accessor_id, "History review")
-            history.append(record.decrypt_data())
-        return history
+        table = self.records[patient_id]
+        self._log_history_access(table, accessor_id)
+        decrypt = self._decrypt_data
+        return [
+            decrypt(nonce, encrypted_data)
+            for nonce, encrypted_data in zip(table["nonces"], table["encrypted"])
+        ]
+
+    def get_patient_history_array(
+        self, patient_id: str, accessor_id: str
+    ) -> Tuple[np.ndarray, List[str]]:
+        """Retrieve the numeric fields of a patient's history as an array"""
+        if not self._check_access_permission(patient_id, accessor_id):
+            raise PermissionError("Access denied")
+
+        if patient_id not in self.records:
+            return np.empty((0, 0)), []
+
+        table = self.records[patient_id]
+        self._log_history_access(table, accessor_id)
+
+        metrics = table["metrics"]
+        columns = [key for key, column in metrics.items() if None not in column]
+        values = np.empty((len(table["encrypted"]), len(columns)))
+        for j, key in enumerate(columns):
+            values[:, j] = metrics[key]
+
+        # Drop metrics that were never actually recorded
+        observed = ~np.isnan(values).all(axis=0)
+        if not observed.all():
+            values = values[:, observed]
+            columns = [key for key, keep in zip(columns, observed) if keep]
+        return values, columns
 
     def grant_access(self, patient_id: str, accessor_id: str):
         """Grant access to medical records"""
-        if patient_id not in self.access_policies:
-            self.access_policies[patient_id] = []
-        if accessor_id not in self.access_policies[patient_id]:
-            self.access_policies[patient_id].append(accessor_id)
+        self.access_policies.setdefault(patient_id, set()).add(accessor_id)
 
     def revoke_access(self, patient_id: str, accessor_id: str):
         """Revoke access to medical records"""
-        if (
-            patient_id in self.access_policies
-            and accessor_id in self.access_policies[patient_id]
-        ):
-            self.access_policies[patient_id].remove(accessor_id)
+        if patient_id in self.access_policies:
+            self.access_policies[patient_id].discard(accessor_id)
 
     def _check_access_permission(self, patient_id: str, accessor_id: str) -> bool:
         """Check if accessor has permission to access patient's records"""
-        return patient_id == accessor_id or (
-            patient_id in self.access_policies
-            and accessor_id in self.access_policies[patient_id]
+        return patient_id == accessor_id or accessor_id in self.access_policies.get(
+            patient_id, ()
         )
 
     def get_access_log(self, patient_id: str, accessor_id: str) -> List[Dict[str, Any]]:
@@ -109,10 +179,9 @@ class MedicalDataManager:
         if patient_id not in self.records:
             return []
 
-        all_logs = []
-        for record in self.records[patient_id]:
-            all_logs.extend(record.access_log)
-        return all_logs
+        return list(
+            itertools.chain.from_iterable(self.records[patient_id]["access_logs"])
+        )
 
     def update_record(
         self,
@@ -126,13 +195,15 @@ class MedicalDataManager:
             raise PermissionError("Access denied")
 
         if patient_id in self.records and 0 <= record_index < len(
-            self.records[patient_id]
+            self.records[patient_id]["encrypted"]
         ):
 
-            record = self.records[patient_id][record_index]
-            new_record = MedicalRecord(patient_id, updated_data, self.encryption_key)
-            new_record.access_log = record.access_log
-            new_record.log_access(accessor_id, "Record update")
-            self.records[patient_id][record_index] = new_record
+            table = self.records[patient_id]
+            nonce, encrypted_data = self._encrypt_data(updated_data)
+            table["encrypted"][record_index] = encrypted_data
+            table["nonces"][record_index] = nonce
+            table["timestamps"][record_index] = datetime.now()
+            self._store_metrics(table, record_index, updated_data)
+            self._log_access(table, record_index, accessor_id, "Record update")
             return True
         return False
@@ -1,134 +1,556 @@
-from cryptography.fernet import Fernet
+from typing import Dict, List, Any, Iterable, Tuple
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, AESGCMSIV
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric.x25519 import (
+    X25519PrivateKey,
+    X25519PublicKey,
+)
 from cryptography.hazmat.primitives import serialization
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import itertools
+import asyncio
+import functools
+import threading
+import hashlib
+import binascii
 import base64
 import os
 
+try:
+    from fastpbkdf2 import pbkdf2_hmac as _pbkdf2
+except ImportError:
+    from hashlib import pbkdf2_hmac as _pbkdf2
+
+# OAEP padding is immutable, so one instance serves every RSA operation
+_OAEP_SHA256 = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None,
+)
+
+# OWASP's recommended PBKDF2-HMAC-SHA512 work factor
+_PBKDF2_ITERATIONS = 210000
+
+# Set NEXUS_PBKDF2_ITERATIONS to change the default count, e.g. to
+# re-derive keys made with an older one. Derived keys depend on it, so
+# pin the value wherever keys must be re-derivable.
+_PBKDF2_ITERS = int(os.environ.get("NEXUS_PBKDF2_ITERATIONS") or _PBKDF2_ITERATIONS)
+
+# Maps standard base64 to the urlsafe alphabet in one translate
+_URLSAFE_B64 = bytes.maketrans(b"+/", b"-_")
+
+
+def _urlsafe_b64encode(raw: bytes) -> bytes:
+    """Encode bytes as urlsafe base64 without the base64 module's wrappers"""
+    return binascii.b2a_base64(raw, newline=False).translate(_URLSAFE_B64)
+
+
+# Recently derived password keys. Entries are keyed by a keyed BLAKE2b of
+# the password under a per-process pepper, never the password itself.
+_KDF_CACHE_SIZE = 128
+_kdf_cache: OrderedDict = OrderedDict()
+_kdf_cache_lock = threading.Lock()
+_PROCESS_PEPPER = os.urandom(32)
+
+# Parsed peer public keys, keyed by the SHA-256 of their PEM encoding
+_PEER_KEY_CACHE_SIZE = 256
+_peer_key_cache: OrderedDict = OrderedDict()
+_peer_key_cache_lock = threading.Lock()
+
+
+def _load_peer_public_key(pem: bytes):
+    """Parse a peer's PEM public key, reusing recently parsed keys"""
+    fingerprint = hashlib.sha256(pem).digest()
+    with _peer_key_cache_lock:
+        public_key = _peer_key_cache.get(fingerprint)
+        if public_key is not None:
+            _peer_key_cache.move_to_end(fingerprint)
+            return public_key
+
+    public_key = serialization.load_pem_public_key(pem)
+    with _peer_key_cache_lock:
+        _peer_key_cache[fingerprint] = public_key
+        if len(_peer_key_cache) > _PEER_KEY_CACHE_SIZE:
+            _peer_key_cache.popitem(last=False)
+    return public_key
+
+
+class _CtrDrbg:
+    """AES-256-CTR generator serving salts and nonces from a buffer"""
+
+    _BUFFER_SIZE = 4096
+    _RESEED_INTERVAL = 1 << 20
+    _KEYSTREAM_INPUT = bytes(32 + _BUFFER_SIZE)
 
-class EncryptionManager:
     def __init__(self):
-        self.symmetric_key = None
-        self.private_key = None
-        self.public_key = None
+        self._lock = threading.Lock()
+        # Key || output, refilled in place; update_into needs room for a
+        # block's worth of slack past the input length. The key only ever
+        # lives in the slot, so each refill overwrites the previous one.
+        self._block = bytearray(len(self._KEYSTREAM_INPUT) + 15)
+        view = memoryview(self._block)
+        self._key_slot = view[:32]
+        self._output = view[32 : 32 + self._BUFFER_SIZE]
+        self._reseed()
+        # A forked child must never replay the parent's stream (GCM nonces);
+        # platforms without fork (Windows) have nothing to guard
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reseed_after_fork)
+
+    def _reseed(self):
+        """Draw a fresh key from the OS and drop buffered output"""
+        self._key_slot[:] = os.urandom(32)
+        self._buffer = b""
+        self._offset = 0
+        self._generated = 0
+
+    def _reseed_after_fork(self):
+        self._lock = threading.Lock()
+        self._reseed()
+
+    def _refill(self):
+        """Generate the next buffer, replacing the key with fresh output"""
+        if self._generated >= self._RESEED_INTERVAL:
+            self._reseed()
+        encryptor = Cipher(
+            algorithms.AES(self._key_slot), modes.CTR(bytes(16))
+        ).encryptor()
+        # Overwrites the current key with the next one, so earlier output
+        # stays unrecoverable; the output is copied out once per refill
+        encryptor.update_into(self._KEYSTREAM_INPUT, self._block)
+        self._buffer = bytes(self._output)
+        self._offset = 0
+        self._generated += self._BUFFER_SIZE
+
+    def random_bytes(self, n: int) -> bytes:
+        """Return n random bytes"""
+        with self._lock:
+            start = self._offset
+            if start + n <= len(self._buffer):
+                self._offset = start + n
+                return self._buffer[start : start + n]
+
+            chunks = []
+            while n > 0:
+                if self._offset == len(self._buffer):
+                    self._refill()
+                take = min(n, len(self._buffer) - self._offset)
+                chunks.append(self._buffer[self._offset : self._offset + take])
+                self._offset += take
+                n -= take
+        return b"".join(chunks)
+
+
+_drbg = _CtrDrbg()
+_fast_random_bytes = _drbg.random_bytes
+
+# PBKDF2 derives in hashlib release the GIL, so batches spread across cores
+_kdf_executor = ThreadPoolExecutor(
+    max_workers=os.cpu_count() or 1, thread_name_prefix="nexus-kdf"
+)
+
+# RSA keygen runs here so the primality search overlaps other startup work
+_keygen_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="nexus-rsa-keygen"
+)
+
+
+def _generate_rsa_key() -> rsa.RSAPrivateKey:
+    """Generate a 2048-bit RSA private key"""
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+class EncryptionManager:
+    def __init__(self, prefetch_asymmetric_keys: bool = False):
+        self._raw_key = None
+        self._aead = None
+        self._siv = None
+        self._sequence = itertools.count()
+        self._private_key = None
+        self._public_key = None
+        self._decrypt = None
+        self._encrypt_oaep = None
+        self._public_pem = None
+        # (keyed digest of the export password, encrypted PEM)
+        self._private_pem = None
+        self._keygen_future = None
+        # Serializes key installs against threads resolving a keygen
+        self._key_lock = threading.Lock()
+        self._exchange_key = None
+        if prefetch_asymmetric_keys:
+            self.generate_asymmetric_keys()
+
+    @property
+    def symmetric_key(self):
+        """Symmetric key as urlsafe base64, the format Fernet keys used"""
+        if self._raw_key is None:
+            return None
+        return _urlsafe_b64encode(self._raw_key)
+
+    @symmetric_key.setter
+    def symmetric_key(self, key):
+        """Install a urlsafe base64 key and build its cipher once"""
+        self._siv = None
+        self._sequence = itertools.count()
+        if key is None:
+            self._raw_key = None
+            self._aead = None
+            return
+        self._raw_key = base64.urlsafe_b64decode(key)
+        self._aead = AESGCM(self._raw_key)
+
+    def _sequenced_aead(self) -> AESGCMSIV:
+        """Build the AES-GCM-SIV cipher for sequenced messages on first use"""
+        if self._aead is None:
+            raise ValueError("Symmetric key not initialized")
+
+        if self._siv is None:
+            # A separate subkey keeps counter nonces apart from the random
+            # nonces encrypt_symmetric uses under the main key
+            subkey = HKDF(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=None,
+                info=b"nexus sequenced aes-gcm-siv",
+            ).derive(self._raw_key)
+            self._siv = AESGCMSIV(subkey)
+        return self._siv
 
     def generate_symmetric_key(self):
         """Generate a new symmetric encryption key"""
-        self.symmetric_key = Fernet.generate_key()
+        self.symmetric_key = _urlsafe_b64encode(AESGCM.generate_key(bit_length=256))
         return self.symmetric_key
 
-    def generate_asymmetric_keys(self):
-        """Generate RSA key pair"""
-        self.private_key = rsa.generate_private_key(
-            public_exponent=65537, key_size=2048
+    def _install_private_key(self, private_key):
+        """Install an RSA private key and its derived public key"""
+        self._private_key = private_key
+        self._private_pem = None
+        if private_key is None:
+            self._install_public_key(None)
+            self._decrypt = None
+        else:
+            self._install_public_key(private_key.public_key())
+            # Generated keys carry p, q, dmp1, dmq1 and iqmp, so OpenSSL
+            # takes the CRT path; bind the padding once for decrypt
+            self._decrypt = functools.partial(private_key.decrypt, padding=_OAEP_SHA256)
+        # Cleared last: a reader that sees no pending keygen must also see
+        # every installed field
+        self._keygen_future = None
+
+    def _install_public_key(self, public_key):
+        """Install an RSA public key with its OAEP encrypt pre-bound"""
+        self._public_key = public_key
+        self._public_pem = None
+        self._encrypt_oaep = (
+            None
+            if public_key is None
+            else functools.partial(public_key.encrypt, padding=_OAEP_SHA256)
         )
-        self.public_key = self.private_key.public_key()
-        return self.public_key
+
+    def _resolve_keygen(self):
+        """Wait for a pending background keygen and install its result"""
+        future = self._keygen_future
+        if future is not None:
+            private_key = future.result()
+            with self._key_lock:
+                if self._keygen_future is future:
+                    self._install_private_key(private_key)
+
+    @property
+    def private_key(self):
+        """RSA private key, waiting on background generation if pending"""
+        self._resolve_keygen()
+        return self._private_key
+
+    @private_key.setter
+    def private_key(self, private_key):
+        with self._key_lock:
+            self._install_private_key(private_key)
+
+    @property
+    def public_key(self):
+        """RSA public key, waiting on background generation if pending"""
+        self._resolve_keygen()
+        return self._public_key
+
+    @public_key.setter
+    def public_key(self, public_key):
+        with self._key_lock:
+            self._install_public_key(public_key)
+            self._keygen_future = None
+
+    def generate_asymmetric_keys(self, eager: bool = False):
+        """Generate RSA key pair, in the background unless eager"""
+        if eager:
+            private_key = _generate_rsa_key()
+            with self._key_lock:
+                self._install_private_key(private_key)
+            return
+
+        with self._key_lock:
+            self._keygen_future = _keygen_executor.submit(_generate_rsa_key)
 
     def encrypt_symmetric(self, data: bytes) -> bytes:
         """Encrypt data using symmetric encryption"""
-        if not self.symmetric_key:
+        if self._aead is None:
             raise ValueError("Symmetric key not initialized")
 
-        f = Fernet(self.symmetric_key)
-        return f.encrypt(data)
+        # Output layout: 12-byte nonce || ciphertext || 16-byte tag
+        nonce = _fast_random_bytes(12)
+        return nonce + self._aead.encrypt(nonce, data, None)
 
     def decrypt_symmetric(self, encrypted_data: bytes) -> bytes:
         """Decrypt data using symmetric encryption"""
-        if not self.symmetric_key:
+        if self._aead is None:
+            raise ValueError("Symmetric key not initialized")
+
+        nonce, ciphertext = encrypted_data[:12], encrypted_data[12:]
+        return self._aead.decrypt(nonce, ciphertext, None)
+
+    def encrypt_symmetric_many(self, items: List[bytes]) -> List[bytes]:
+        """Encrypt a batch of items, drawing all nonces in one call"""
+        if self._aead is None:
             raise ValueError("Symmetric key not initialized")
 
-        f = Fernet(self.symmetric_key)
-        return f.decrypt(encrypted_data)
+        encrypt = self._aead.encrypt
+        nonces = _fast_random_bytes(12 * len(items))
+        return [
+            nonces[i : i + 12] + encrypt(nonces[i : i + 12], data, None)
+            for i, data in zip(range(0, len(nonces), 12), items)
+        ]
+
+    def decrypt_symmetric_many(self, items: List[bytes]) -> List[bytes]:
+        """Decrypt a batch of items produced by encrypt_symmetric_many"""
+        if self._aead is None:
+            raise ValueError("Symmetric key not initialized")
+
+        decrypt = self._aead.decrypt
+        return [decrypt(data[:12], data[12:], None) for data in items]
+
+    def encrypt_sequenced(self, data: bytes) -> Tuple[int, bytes]:
+        """Encrypt data under the next sequence number, returning (seq, ct)"""
+        siv = self._sequenced_aead()
+        # GCM-SIV only leaks repeated plaintexts if a counter value is
+        # reused, e.g. after restoring the same key in a new manager
+        seq = next(self._sequence)
+        return seq, siv.encrypt(seq.to_bytes(12, "big"), data, None)
+
+    def decrypt_sequenced(self, seq: int, encrypted_data: bytes) -> bytes:
+        """Decrypt data produced by encrypt_sequenced"""
+        return self._sequenced_aead().decrypt(
+            seq.to_bytes(12, "big"), encrypted_data, None
+        )
 
     def encrypt_asymmetric(self, data: bytes) -> bytes:
         """Encrypt data using asymmetric encryption"""
         if not self.public_key:
             raise ValueError("Public key not initialized")
 
-        return self.public_key.encrypt(
-            data,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None,
-            ),
-        )
+        return self._encrypt_oaep(data)
 
     def decrypt_asymmetric(self, encrypted_data: bytes) -> bytes:
         """Decrypt data using asymmetric encryption"""
         if not self.private_key:
             raise ValueError("Private key not initialized")
 
-        return self.private_key.decrypt(
-            encrypted_data,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None,
-            ),
-        )
+        return self._decrypt(encrypted_data)
 
     def export_public_key(self) -> bytes:
         """Export public key in PEM format"""
         if not self.public_key:
             raise ValueError("Public key not initialized")
 
-        return self.public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo,
-        )
+        if self._public_pem is None:
+            self._public_pem = self._public_key.public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+        return self._public_pem
 
     def export_private_key(self, password: bytes) -> bytes:
         """Export encrypted private key in PEM format"""
         if not self.private_key:
             raise ValueError("Private key not initialized")
 
-        return self.private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.BestAvailableEncryption(password),
-        )
+        # Only the most recent export is kept, so at most one encrypted
+        # copy of the key stays in memory
+        password_digest = hashlib.blake2b(
+            password, key=_PROCESS_PEPPER, digest_size=16
+        ).digest()
+        if self._private_pem is None or self._private_pem[0] != password_digest:
+            pem = self._private_key.private_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PrivateFormat.PKCS8,
+                encryption_algorithm=serialization.BestAvailableEncryption(password),
+            )
+            self._private_pem = (password_digest, pem)
+        return self._private_pem[1]
 
     @staticmethod
-    def generate_key_from_password(password: str, salt: bytes = None) -> bytes:
-        """Generate encryption key from password using PBKDF2"""
+    def generate_key_from_password(
+        password: str,
+        salt: bytes = None,
+        algorithm: hashes.HashAlgorithm = None,
+        iterations: int = None,
+        cache: bool = True,
+    ) -> Tuple[bytes, bytes]:
+        """Generate a raw 32-byte key and its salt from a password via PBKDF2"""
         if salt is None:
-            salt = os.urandom(16)
+            # A fresh salt can never be looked up again, so skip the cache
+            salt = _fast_random_bytes(16)
+            cache = False
+        if algorithm is None:
+            algorithm = hashes.SHA512()
+        if iterations is None:
+            iterations = _PBKDF2_ITERS
 
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
+        if cache:
+            password_digest = hashlib.blake2b(
+                password.encode(), key=_PROCESS_PEPPER, digest_size=16
+            ).digest()
+            cache_key = (password_digest, salt, algorithm.name, iterations)
+            with _kdf_cache_lock:
+                key = _kdf_cache.get(cache_key)
+                if key is not None:
+                    _kdf_cache.move_to_end(cache_key)
+                    return key, salt
+
+        key = _pbkdf2(algorithm.name, password.encode(), salt, iterations, 32)
 
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
+        if cache:
+            with _kdf_cache_lock:
+                _kdf_cache[cache_key] = key
+                if len(_kdf_cache) > _KDF_CACHE_SIZE:
+                    _kdf_cache.popitem(last=False)
         return key, salt
 
+    @staticmethod
+    def generate_keys_from_passwords(
+        batch: List[Tuple[str, bytes]],
+        algorithm: hashes.HashAlgorithm = None,
+        iterations: int = None,
+    ) -> List[bytes]:
+        """Derive raw keys for (password, salt) pairs in parallel"""
+        derive = EncryptionManager.generate_key_from_password
+        return [
+            key
+            for key, _ in _kdf_executor.map(
+                lambda item: derive(item[0], item[1], algorithm, iterations), batch
+            )
+        ]
+
+    @classmethod
+    async def derive_many(
+        cls,
+        items: List[Tuple[str, bytes]],
+        algorithm: hashes.HashAlgorithm = None,
+        iterations: int = None,
+    ) -> List[bytes]:
+        """Derive raw keys for (password, salt) pairs off the event loop"""
+        loop = asyncio.get_running_loop()
+        derivations = [
+            loop.run_in_executor(
+                _kdf_executor,
+                functools.partial(
+                    cls.generate_key_from_password,
+                    password,
+                    salt,
+                    algorithm,
+                    iterations,
+                ),
+            )
+            for password, salt in items
+        ]
+        return [key for key, _ in await asyncio.gather(*derivations)]
+
+    @staticmethod
+    def to_fernet_key(raw_key: bytes) -> bytes:
+        """Encode a raw 32-byte key in the urlsafe base64 form Fernet expects"""
+        return _urlsafe_b64encode(raw_key)
+
     @staticmethod
     def hash_data(data: bytes) -> bytes:
         """Generate SHA-256 hash of data"""
-        digest = hashes.Hash(hashes.SHA256())
-        digest.update(data)
-        return digest.finalize()
+        return hashlib.sha256(data).digest()
+
+    @staticmethod
+    def hash_many(items: Iterable[bytes]) -> List[bytes]:
+        """Generate SHA-256 hashes of a batch of items"""
+        sha256 = hashlib.sha256
+        return [sha256(data).digest() for data in items]
+
+    def export_exchange_public_key(self) -> bytes:
+        """Export the raw 32-byte X25519 key peers use for key exchange"""
+        if self._exchange_key is None:
+            self._exchange_key = X25519PrivateKey.generate()
+        return self._exchange_key.public_key().public_bytes_raw()
 
-    def secure_key_exchange(self, other_public_key_pem: bytes) -> bytes:
+    @staticmethod
+    def _derive_session_cipher(
+        shared_secret: bytes, ephemeral_public: bytes, static_public: bytes
+    ) -> AESGCM:
+        """Expand an X25519 shared secret into an AES-GCM session cipher"""
+        session_key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b"nexus key exchange" + ephemeral_public + static_public,
+        ).derive(shared_secret)
+        return AESGCM(session_key)
+
+    def secure_key_exchange(self, other_public_key: bytes) -> Dict[str, Any]:
         """Perform secure key exchange"""
-        other_public_key = serialization.load_pem_public_key(other_public_key_pem)
+        # Raw 32-byte keys come from export_exchange_public_key; PEM keys
+        # may be X25519 or, for legacy peers, RSA
+        if len(other_public_key) == 32:
+            peer_key = X25519PublicKey.from_public_bytes(other_public_key)
+        else:
+            peer_key = _load_peer_public_key(other_public_key)
+
+        if isinstance(peer_key, X25519PublicKey):
+            ephemeral_key = X25519PrivateKey.generate()
+            ephemeral_public = ephemeral_key.public_key().public_bytes_raw()
+            aead = self._derive_session_cipher(
+                ephemeral_key.exchange(peer_key),
+                ephemeral_public,
+                peer_key.public_bytes_raw(),
+            )
+            return {"ephemeral_public_key": ephemeral_public, "aead": aead}
 
+        return self._rsa_key_exchange(peer_key)
+
+    @staticmethod
+    def _rsa_key_exchange(other_public_key) -> Dict[str, Any]:
+        """Wrap a fresh session key for a legacy RSA peer"""
         # Generate a new symmetric key for the session
-        session_key = Fernet.generate_key()
+        session_key = AESGCM.generate_key(bit_length=256)
 
         # Encrypt the session key with the other party's public key
-        encrypted_session_key = other_public_key.encrypt(
-            session_key,
-            padding.OAEP(
-                mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                algorithm=hashes.SHA256(),
-                label=None,
-            ),
-        )
+        encrypted_session_key = other_public_key.encrypt(session_key, _OAEP_SHA256)
+
+        # One RSA operation per session; messages reuse the AES-GCM cipher
+        return {"wrapped": encrypted_session_key, "aead": AESGCM(session_key)}
+
+    def accept_key_exchange(self, exchange_data: bytes) -> AESGCM:
+        """Recover the session cipher from secure_key_exchange's output"""
+        # A 32-byte message is an X25519 ephemeral key; anything else is
+        # an RSA-wrapped session key
+        if len(exchange_data) == 32:
+            if self._exchange_key is None:
+                raise ValueError("Exchange key not initialized")
+
+            ephemeral_key = X25519PublicKey.from_public_bytes(exchange_data)
+            return self._derive_session_cipher(
+                self._exchange_key.exchange(ephemeral_key),
+                exchange_data,
+                self.export_exchange_public_key(),
+            )
+
+        if not self.private_key:
+            raise ValueError("Private key not initialized")
 
-        return encrypted_session_key
+        return AESGCM(self._decrypt(exchange_data))